@@ -1,19 +1,32 @@
 import os
+import re
+import json
+import time
+import asyncio
 import logging
+import contextlib
+import functools
 import datetime as dt
+from collections import OrderedDict, deque
 from typing import Optional
 
-import requests
+import aiohttp
+import orjson
+from redis import asyncio as aioredis
 from aiogram import Bot, Dispatcher, BaseMiddleware
-from aiogram.types import Message, TelegramObject
-from aiogram.filters import Command, CommandObject
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import SendMessage
+from aiogram.types import Message, TelegramObject, ErrorEvent
+from aiogram.filters import Command, CommandObject, ExceptionTypeFilter
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
 
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OWM_API_KEY = os.getenv("OWM_API_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
 
 if not BOT_TOKEN:
     raise RuntimeError("Нет BOT_TOKEN в переменных окружения")
@@ -21,7 +34,47 @@ if not BOT_TOKEN:
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("bot")
 
-users: dict[int, dict] = {}
+# L1: in-process cache of user data. With REDIS_URL set it is backed by Redis:
+# misses are loaded from there, changes are written behind by _flush_loop.
+# Whole records are written (last writer wins), so only one bot process may use
+# a given Redis; Telegram long polling allows a single consumer per token anyway.
+USERS_L1_MAX = 10_000
+FLUSH_INTERVAL_S = 2
+DAY_KEY_TTL_S = 90 * 24 * 3600
+DAYS_KEEP = 7  # days before today kept in memory
+IDLE_USER_S = 24 * 3600
+IDLE_SWEEP_S = 600
+
+users: "OrderedDict[int, dict]" = OrderedDict()
+_dirty: set[int] = set()
+redis_db: Optional[aioredis.Redis] = aioredis.from_url(REDIS_URL) if REDIS_URL else None
+_flush_task: Optional[asyncio.Task] = None
+
+http: Optional[aiohttp.ClientSession] = None
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+# after BREAKER_FAILS failed calls in a row a service is skipped for BREAKER_COOLDOWN_S
+BREAKER_FAILS = 5
+BREAKER_COOLDOWN_S = 30
+_breaker = {
+    "owm": {"fails": 0, "open_until": 0.0},
+    "off": {"fails": 0, "open_until": 0.0},
+}
+
+TEMP_REFRESH_S = 300  # older entries are served as-is and refreshed in background
+TEMP_MAX_AGE_S = 3 * 3600  # older entries are not served at all
+TEMP_CACHE_MAX = 1024
+_TEMP_CACHE: "OrderedDict[str, tuple[float, float]]" = OrderedDict()  # city -> (ts, temp_c)
+_TEMP_REFRESHING: dict[str, asyncio.Task] = {}
+
+FOOD_TTL_S = 24 * 3600
+FOOD_CACHE_MAX = 2048
+_FOOD_CACHE: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()  # norm query -> (ts, info)
+
+# Telegram limits: ~30 messages/s overall, ~1 message/s per chat
+SEND_RATE_GLOBAL = 30
+SEND_RATE_CHAT = 1
+CHAT_LIMITERS_MAX = 10_000
 
 
 class LogMiddleware(BaseMiddleware):
@@ -32,20 +85,96 @@ class LogMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
+class RateLimiter:
+    """Lets through at most `rate` entries per `period` seconds, the rest wait."""
+
+    def __init__(self, rate: int, period: float = 1.0):
+        self.rate = rate
+        self.period = period
+        self._sent: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.period:
+                    self._sent.popleft()
+                if len(self._sent) < self.rate:
+                    break
+                await asyncio.sleep(self.period - (now - self._sent[0]))
+            self._sent.append(now)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_send_limiter = RateLimiter(SEND_RATE_GLOBAL)
+_chat_limiters: "OrderedDict[int | str, RateLimiter]" = OrderedDict()
+
+
+def _chat_limiter(chat_id) -> RateLimiter:
+    limiter = _chat_limiters.get(chat_id)
+    if limiter is None:
+        limiter = _chat_limiters[chat_id] = RateLimiter(SEND_RATE_CHAT)
+        if len(_chat_limiters) > CHAT_LIMITERS_MAX:
+            _chat_limiters.popitem(last=False)
+    _chat_limiters.move_to_end(chat_id)
+    return limiter
+
+
+class SendLimitMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, SendMessage):
+            return await make_request(bot, method)
+        async with _chat_limiter(method.chat_id), _send_limiter:
+            return await make_request(bot, method)
+
+
+class StorageUnavailable(Exception):
+    pass
+
+
 def today_key() -> str:
     return dt.date.today().isoformat()
 
 
-def ensure_user(user_id: int) -> None:
-    if user_id not in users:
-        users[user_id] = {"profile": None, "days": {}}
+def _profile_key(user_id: int) -> str:
+    return f"user:{user_id}:profile"
+
 
+def _day_key(user_id: int, day: str) -> str:
+    return f"user:{user_id}:day:{day}"
 
-def ensure_day(user_id: int, day: str) -> None:
-    ensure_user(user_id)
-    days = users[user_id]["days"]
-    if day not in days:
-        days[day] = {
+
+async def _load_json(key: str):
+    if redis_db is None:
+        return None
+    try:
+        raw = await redis_db.get(key)
+    except Exception as e:
+        # don't fall back to empty defaults: write-behind would overwrite the stored data
+        log.exception(f"failed to load {key} from redis")
+        raise StorageUnavailable from e
+    return json.loads(raw) if raw else None
+
+
+async def ensure_user(user_id: int) -> dict:
+    entry = users.get(user_id)
+    if entry is None:
+        profile = await _load_json(_profile_key(user_id))
+        if profile is not None:
+            fill_goals(profile)
+        entry = users.setdefault(user_id, {"profile": profile, "days": {}})
+    entry["last_seen"] = time.monotonic()
+    users.move_to_end(user_id)
+    return entry
+
+
+async def ensure_day(user_id: int, day: str) -> dict:
+    entry = await ensure_user(user_id)
+    if day not in entry["days"]:
+        d = await _load_json(_day_key(user_id, day)) or {
             "water_ml": 0,
             "cal_in": 0.0,
             "cal_out": 0.0,
@@ -53,80 +182,286 @@ def ensure_day(user_id: int, day: str) -> None:
             "foods": [],
             "workouts": [],
         }
+        # the entry may have been evicted while we were waiting on Redis
+        entry = await ensure_user(user_id)
+        days = entry["days"]
+        days.setdefault(day, d)
+
+        cutoff = (dt.date.fromisoformat(day) - dt.timedelta(days=DAYS_KEEP)).isoformat()
+        for k in list(days):
+            if k < cutoff:
+                del days[k]
+    return entry["days"][day]
+
+
+async def profile_of(user_id: int) -> Optional[dict]:
+    return (await ensure_user(user_id))["profile"]
 
 
-def profile_of(user_id: int) -> Optional[dict]:
-    ensure_user(user_id)
-    return users[user_id]["profile"]
+async def save_profile(user_id: int, profile: dict) -> None:
+    (await ensure_user(user_id))["profile"] = profile
+    if redis_db is None:
+        return
+    try:
+        await redis_db.set(_profile_key(user_id), json.dumps(profile))
+    except Exception:
+        log.exception("failed to save profile, leaving it to write-behind")
+        mark_dirty(user_id)
+
+
+def mark_dirty(user_id: int) -> None:
+    if redis_db is not None:
+        _dirty.add(user_id)
+
+
+async def flush_users() -> None:
+    if redis_db is None or not _dirty:
+        return
+
+    batch = list(_dirty)
+    _dirty.clear()
+    flushed = False
+    try:
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for uid in batch:
+                entry = users.get(uid)
+                if entry is None:
+                    continue
+                if entry["profile"] is not None:
+                    pipe.set(_profile_key(uid), json.dumps(entry["profile"]))
+                for day, d in entry["days"].items():
+                    pipe.set(_day_key(uid, day), json.dumps(d), ex=DAY_KEY_TTL_S)
+            await pipe.execute()
+        flushed = True
+    except Exception:
+        log.exception("failed to flush users to redis")
+    finally:
+        # also on cancellation, so that the final flush at shutdown picks the batch up
+        if not flushed:
+            _dirty.update(batch)
+    if not flushed:
+        return
+
+    # only clean entries can be dropped, they will be reloaded on demand
+    for uid in list(users):
+        if len(users) <= USERS_L1_MAX:
+            break
+        if uid not in _dirty:
+            del users[uid]
+
+
+def evict_idle_users() -> None:
+    # dropped users are reloaded from Redis on their next message
+    if redis_db is None:
+        return
+    cutoff = time.monotonic() - IDLE_USER_S
+    for uid, entry in list(users.items()):
+        if entry["last_seen"] < cutoff and uid not in _dirty:
+            del users[uid]
+
+
+async def _flush_loop() -> None:
+    last_sweep = time.monotonic()
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_S)
+        await flush_users()
+        if time.monotonic() - last_sweep >= IDLE_SWEEP_S:
+            evict_idle_users()
+            last_sweep = time.monotonic()
+
+
+async def _get_json(svc: str, url: str, params: dict) -> Optional[dict]:
+    b = _breaker[svc]
+    if time.monotonic() < b["open_until"]:
+        return None
+
+    try:
+        async with http.get(url, params=params, timeout=HTTP_TIMEOUT) as r:
+            status = r.status
+            body = await r.read()
+    except Exception:
+        status = None
+
+    # 4xx (bad city, etc.) means the service is up, only timeouts/5xx/429 count
+    if status is None or status >= 500 or status == 429:
+        b["fails"] += 1
+        if b["fails"] >= BREAKER_FAILS:
+            b["open_until"] = time.monotonic() + BREAKER_COOLDOWN_S
+            log.warning(f"{svc} is failing, skipping it for {BREAKER_COOLDOWN_S}s")
+        return None
+
+    b["fails"] = 0
+    if status != 200:
+        return None
+    return orjson.loads(body)
+
 
+def _city_key(city: str) -> str:
+    return city.strip().lower()
 
-def get_temp_c(city: str) -> Optional[float]:
+
+def get_temp_c_cached(city: str, max_age: float = TEMP_MAX_AGE_S) -> Optional[float]:
+    key = _city_key(city)
+    hit = _TEMP_CACHE.get(key)
+    if not hit or time.monotonic() - hit[0] >= max_age:
+        return None
+    _TEMP_CACHE.move_to_end(key)
+    return hit[1]
+
+
+async def refresh_temp(city: str) -> Optional[float]:
     if not OWM_API_KEY:
         return None
     try:
         url = "https://api.openweathermap.org/data/2.5/weather"
         params = {"q": city, "appid": OWM_API_KEY, "units": "metric", "lang": "ru"}
-        r = requests.get(url, params=params, timeout=10)
-        if r.status_code != 200:
+        data = await _get_json("owm", url, params)
+        if data is None:
             return None
-        data = r.json()
-        return float(data["main"]["temp"])
+        temp = float(data["main"]["temp"])
     except Exception:
         return None
 
+    key = _city_key(city)
+    _TEMP_CACHE[key] = (time.monotonic(), temp)
+    _TEMP_CACHE.move_to_end(key)
+    if len(_TEMP_CACHE) > TEMP_CACHE_MAX:
+        _TEMP_CACHE.popitem(last=False)
+    return temp
+
+
+def _schedule_temp_refresh(city: str) -> None:
+    key = _city_key(city)
+    if key in _TEMP_REFRESHING:
+        return
+    task = asyncio.create_task(refresh_temp(city))
+    _TEMP_REFRESHING[key] = task
+    task.add_done_callback(lambda _: _TEMP_REFRESHING.pop(key, None))
+
+
+async def get_temp_c(city: str) -> Optional[float]:
+    if not OWM_API_KEY:
+        return None
+
+    temp = get_temp_c_cached(city)
+    if temp is None:
+        return await refresh_temp(city)
+
+    if get_temp_c_cached(city, TEMP_REFRESH_S) is None:
+        _schedule_temp_refresh(city)
+    return temp
+
+
+def _keep_cp(cp: int) -> Optional[int]:
+    ch = chr(cp)
+    return cp if ch.isalnum() or ch.isspace() else None
+
+
+class _DropTable(dict):
+    # str.translate table: drops everything except letters, digits and whitespace.
+    # Latin/Cyrillic are prebuilt, other codepoints are classified on first sight.
+    def __missing__(self, cp: int) -> Optional[int]:
+        v = self[cp] = _keep_cp(cp)
+        return v
+
+
+_NORM_TABLE = _DropTable((cp, _keep_cp(cp)) for cp in range(0x500))
+
 
 def _norm(s: str) -> str:
-    return "".join(ch.lower() for ch in s if ch.isalnum() or ch.isspace()).strip()
+    # measured a bit faster than re.sub(r"[^\w\s]+|_+", "", s) on product names.
+    # Lowercasing the whole string (not char by char) applies Greek final sigma:
+    # "ΣΑΣ" -> "σας"; harmless here since query and names go through the same path.
+    return s.translate(_NORM_TABLE).lower().strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def _tokens(normed: str) -> frozenset[str]:
+    return frozenset(normed.split())
+
+
+async def get_food_kcal_100g(query: str) -> Optional[dict]:
+    key = _norm(query)
+    now = time.monotonic()
+    hit = _FOOD_CACHE.get(key)
+    if hit:
+        if now - hit[0] < FOOD_TTL_S:
+            _FOOD_CACHE.move_to_end(key)
+            return dict(hit[1])
+        del _FOOD_CACHE[key]
+
+    info = await _search_food(query)
+    if info is not None:
+        _FOOD_CACHE[key] = (now, info)
+        if len(_FOOD_CACHE) > FOOD_CACHE_MAX:
+            _FOOD_CACHE.popitem(last=False)
+        info = dict(info)
+    return info
+
+
+async def _fetch_food_raw(query: str) -> Optional[dict]:
+    url = "https://world.openfoodfacts.org/cgi/search.pl"
+    params = {
+        "action": "process",
+        "search_terms": query,
+        "json": "true",
+        "page_size": 5,
+        "fields": "product_name,generic_name,nutriments",
+    }
+    return await _get_json("off", url, params)
 
 
-def get_food_kcal_100g(query: str) -> Optional[dict]:
-    try:
-        url = "https://world.openfoodfacts.org/cgi/search.pl"
-        params = {"action": "process", "search_terms": query, "json": "true", "page_size": 10}
-        r = requests.get(url, params=params, timeout=10)
-        if r.status_code != 200:
-            return None
-        data = r.json()
-        products = data.get("products", []) or []
+def _score_products(data: dict, query: str) -> Optional[dict]:
+    products = data.get("products", []) or []
 
-        qn = _norm(query)
-        best = None  # (score, name, kcal)
+    qn = _norm(query)
+    q_tokens = _tokens(qn)
+    max_score = 3 + 2 * len(q_tokens)
+    best = None  # (score, name, kcal)
 
-        for p in products:
-            nutr = p.get("nutriments") or {}
-            kcal = nutr.get("energy-kcal_100g")
+    for p in products:
+        nutr = p.get("nutriments") or {}
+        kcal = nutr.get("energy-kcal_100g")
 
-            if kcal is None:
-                kj = nutr.get("energy_100g")
-                if kj is None:
-                    continue
-                kcal = float(kj) / 4.184
+        if kcal is None:
+            kj = nutr.get("energy_100g")
+            if kj is None:
+                continue
+            kcal = float(kj) / 4.184
+
+        name = p.get("product_name") or p.get("generic_name") or "Продукт"
+        nn = _norm(name)
 
-            name = p.get("product_name") or p.get("generic_name") or "Продукт"
-            nn = _norm(name)
+        score = (3 if qn and qn in nn else 0) + 2 * len(q_tokens & _tokens(nn))
 
-            score = 0
-            if qn and qn in nn:
-                score += 3
-            for w in qn.split():
-                if w and w in nn:
-                    score += 2
+        cand = (score, name, float(kcal))
+        if best is None or cand[0] > best[0]:
+            best = cand
+            if score >= max_score:
+                break
+
+    if best is None:
+        return None
+    return {"name": best[1], "kcal_100g": best[2]}
 
-            cand = (score, name, float(kcal))
-            if best is None or cand[0] > best[0]:
-                best = cand
 
-        if best is None:
+async def _search_food(query: str) -> Optional[dict]:
+    try:
+        data = await _fetch_food_raw(query)
+        if data is None:
             return None
-        return {"name": best[1], "kcal_100g": best[2]}
+        return await asyncio.to_thread(_score_products, data, query)
     except Exception:
         return None
 
 
-def calc_water_goal_ml(profile: dict, temp_c: Optional[float], workout_extra_ml: int) -> int:
+def calc_base_water_ml(profile: dict) -> int:
     base = int(profile["weight"] * 30)
     activity_extra = int((profile["activity_min"] / 30) * 500)
+    return base + activity_extra
+
 
+def calc_water_goal_ml(profile: dict, temp_c: Optional[float], workout_extra_ml: int) -> int:
     heat_extra = 0
     if temp_c is not None:
         if temp_c > 30:
@@ -134,7 +469,7 @@ def calc_water_goal_ml(profile: dict, temp_c: Optional[float], workout_extra_ml:
         elif temp_c > 25:
             heat_extra = 500
 
-    return base + activity_extra + heat_extra + int(workout_extra_ml)
+    return profile["_base_water"] + heat_extra + int(workout_extra_ml)
 
 
 def calc_calorie_goal(profile: dict) -> int:
@@ -149,6 +484,13 @@ def calc_calorie_goal(profile: dict) -> int:
     return goal
 
 
+def fill_goals(profile: dict) -> dict:
+    # goals depend only on profile fields, so they are computed once per /set_profile
+    profile["_cal_goal"] = calc_calorie_goal(profile)
+    profile["_base_water"] = calc_base_water_ml(profile)
+    return profile
+
+
 MET = {
     "бег": 9.8,
     "ходьба": 3.5,
@@ -159,8 +501,22 @@ MET = {
 }
 
 
+# word stems -> MET, so that "бега", "велик", "плавал" etc. hit the right type
+_MET_STEMS = {
+    "бег": MET["бег"],
+    "ходьб": MET["ходьба"],
+    "велосипед": MET["велосипед"],
+    "велик": MET["велосипед"],
+    "плава": MET["плавание"],
+    "силов": MET["силовая"],
+    "йог": MET["йога"],
+}
+_MET_RE = re.compile("|".join(sorted(_MET_STEMS, key=len, reverse=True)))
+
+
 def calc_burned_kcal(workout_type: str, minutes: int, weight: float) -> int:
-    met = MET.get(workout_type.lower(), 6.0)
+    m = _MET_RE.match(workout_type.strip().lower())
+    met = _MET_STEMS[m.group()] if m else 6.0
     return int(round(met * weight * (minutes / 60)))
 
 
@@ -178,11 +534,67 @@ class FoodFSM(StatesGroup):
     grams = State()
 
 
+_WATER_TPL = (
+    "Вода записана.\n"
+    "Выпито: {drunk} / {water_goal} мл\n"
+    "Осталось: {left} мл"
+)
+
+_WORKOUT_TPL = (
+    "Тренировка записана.\n"
+    "Тип: {type}\n"
+    "Время: {minutes} мин\n"
+    "Сожжено: {burned} ккал\n"
+    "Доп. вода к норме: {extra_water} мл"
+)
+
+_PROGRESS_TPL = (
+    "Прогресс за сегодня:\n\n"
+    "Температура: {temp}\n\n"
+    "Вода:\n"
+    "- Выпито: {drunk} мл из {water_goal} мл\n"
+    "- Осталось: {water_left} мл\n\n"
+    "Калории:\n"
+    "- Потреблено: {cal_in:.0f} ккал\n"
+    "- Сожжено: {cal_out:.0f} ккал\n"
+    "- Баланс: {cal_balance:.0f} ккал\n"
+    "- Цель: {cal_goal} ккал\n"
+    "- Осталось до цели: {cal_left:.0f} ккал"
+)
+
+
 bot = Bot(BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+bot.session.middleware(SendLimitMiddleware())
+
+if REDIS_URL:
+    # own client: the dispatcher closes the storage before our shutdown hook flushes users
+    storage = RedisStorage.from_url(REDIS_URL)
+else:
+    storage = MemoryStorage()
+
+dp = Dispatcher(storage=storage)
 dp.message.middleware(LogMiddleware())
 
 
+@dp.shutdown()
+async def on_shutdown():
+    if http is not None:
+        await http.close()
+    if _flush_task is not None:
+        _flush_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _flush_task
+    if redis_db is not None:
+        await flush_users()
+        await redis_db.aclose()
+
+
+@dp.error(ExceptionTypeFilter(StorageUnavailable))
+async def on_storage_unavailable(event: ErrorEvent):
+    if event.update.message:
+        await event.update.message.answer("Не удалось загрузить ваши данные, попробуйте позже.")
+
+
 @dp.message(Command("start"))
 async def start(message: Message):
     await message.answer(
@@ -289,17 +701,16 @@ async def prof_cal_goal(message: Message, state: FSMContext):
         "city": data["city"],
         "calorie_goal_override": override,
     }
+    fill_goals(profile)
 
-    ensure_user(message.from_user.id)
-    users[message.from_user.id]["profile"] = profile
-
-    day = today_key()
-    ensure_day(message.from_user.id, day)
-    d = users[message.from_user.id]["days"][day]
-
-    temp = get_temp_c(profile["city"])
+    uid = message.from_user.id
+    temp, d, _ = await asyncio.gather(
+        get_temp_c(profile["city"]),
+        ensure_day(uid, today_key()),
+        save_profile(uid, profile),
+    )
     water_goal = calc_water_goal_ml(profile, temp, d["workout_extra_water_ml"])
-    cal_goal = calc_calorie_goal(profile)
+    cal_goal = profile["_cal_goal"]
 
     temp_str = "нет данных" if temp is None else f"{temp:.1f} C"
     await state.clear()
@@ -313,7 +724,7 @@ async def prof_cal_goal(message: Message, state: FSMContext):
 
 @dp.message(Command("log_water"))
 async def log_water(message: Message, command: CommandObject):
-    profile = profile_of(message.from_user.id)
+    profile = await profile_of(message.from_user.id)
     if not profile:
         return await message.answer("Сначала /set_profile")
 
@@ -327,25 +738,24 @@ async def log_water(message: Message, command: CommandObject):
     except Exception:
         return await message.answer("Введите корректное число мл (например 250).")
 
-    day = today_key()
-    ensure_day(message.from_user.id, day)
-    d = users[message.from_user.id]["days"][day]
+    d = await ensure_day(message.from_user.id, today_key())
     d["water_ml"] += ml
+    mark_dirty(message.from_user.id)
 
-    temp = get_temp_c(profile["city"])
+    temp = await get_temp_c(profile["city"])
     water_goal = calc_water_goal_ml(profile, temp, d["workout_extra_water_ml"])
     left = max(0, water_goal - d["water_ml"])
 
-    await message.answer(
-        "Вода записана.\n"
-        f"Выпито: {d['water_ml']} / {water_goal} мл\n"
-        f"Осталось: {left} мл"
-    )
+    await message.answer(_WATER_TPL.format_map({
+        "drunk": d["water_ml"],
+        "water_goal": water_goal,
+        "left": left,
+    }))
 
 
 @dp.message(Command("log_food"))
 async def log_food(message: Message, command: CommandObject, state: FSMContext):
-    profile = profile_of(message.from_user.id)
+    profile = await profile_of(message.from_user.id)
     if not profile:
         return await message.answer("Сначала /set_profile")
 
@@ -353,7 +763,7 @@ async def log_food(message: Message, command: CommandObject, state: FSMContext):
         return await message.answer("Формат: /log_food банан")
 
     query = command.args.strip()
-    info = get_food_kcal_100g(query)
+    info = await get_food_kcal_100g(query)
 
     await state.clear()
     if info is None:
@@ -384,7 +794,7 @@ async def food_manual_kcal(message: Message, state: FSMContext):
 
 @dp.message(FoodFSM.grams)
 async def food_grams(message: Message, state: FSMContext):
-    profile = profile_of(message.from_user.id)
+    profile = await profile_of(message.from_user.id)
     if not profile:
         await state.clear()
         return await message.answer("Сначала /set_profile")
@@ -401,11 +811,10 @@ async def food_grams(message: Message, state: FSMContext):
     kcal_100g = float(data["kcal_100g"])
     kcal = kcal_100g * grams / 100.0
 
-    day = today_key()
-    ensure_day(message.from_user.id, day)
-    d = users[message.from_user.id]["days"][day]
+    d = await ensure_day(message.from_user.id, today_key())
     d["cal_in"] += kcal
     d["foods"].append((name, grams, kcal))
+    mark_dirty(message.from_user.id)
 
     await state.clear()
     await message.answer(f"Еда записана: {name}, {grams:.0f} г, {kcal:.0f} ккал.")
@@ -413,7 +822,7 @@ async def food_grams(message: Message, state: FSMContext):
 
 @dp.message(Command("log_workout"))
 async def log_workout(message: Message, command: CommandObject):
-    profile = profile_of(message.from_user.id)
+    profile = await profile_of(message.from_user.id)
     if not profile:
         return await message.answer("Сначала /set_profile")
 
@@ -435,35 +844,31 @@ async def log_workout(message: Message, command: CommandObject):
     burned = calc_burned_kcal(workout_type, minutes, profile["weight"])
     extra_water = int((minutes / 30) * 200)
 
-    day = today_key()
-    ensure_day(message.from_user.id, day)
-    d = users[message.from_user.id]["days"][day]
+    d = await ensure_day(message.from_user.id, today_key())
     d["cal_out"] += burned
     d["workout_extra_water_ml"] += extra_water
     d["workouts"].append((workout_type, minutes, burned))
+    mark_dirty(message.from_user.id)
 
-    await message.answer(
-        "Тренировка записана.\n"
-        f"Тип: {workout_type}\n"
-        f"Время: {minutes} мин\n"
-        f"Сожжено: {burned} ккал\n"
-        f"Доп. вода к норме: {extra_water} мл"
-    )
+    await message.answer(_WORKOUT_TPL.format_map({
+        "type": workout_type,
+        "minutes": minutes,
+        "burned": burned,
+        "extra_water": extra_water,
+    }))
 
 
 @dp.message(Command("check_progress"))
 async def check_progress(message: Message):
-    profile = profile_of(message.from_user.id)
+    profile = await profile_of(message.from_user.id)
     if not profile:
         return await message.answer("Сначала /set_profile")
 
-    day = today_key()
-    ensure_day(message.from_user.id, day)
-    d = users[message.from_user.id]["days"][day]
+    d = await ensure_day(message.from_user.id, today_key())
 
-    temp = get_temp_c(profile["city"])
+    temp = await get_temp_c(profile["city"])
     water_goal = calc_water_goal_ml(profile, temp, d["workout_extra_water_ml"])
-    cal_goal = calc_calorie_goal(profile)
+    cal_goal = profile["_cal_goal"]
 
     water_left = max(0, water_goal - d["water_ml"])
     cal_balance = d["cal_in"] - d["cal_out"]
@@ -471,26 +876,29 @@ async def check_progress(message: Message):
 
     temp_str = "нет данных" if temp is None else f"{temp:.1f} C"
 
-    await message.answer(
-        "Прогресс за сегодня:\n\n"
-        f"Температура: {temp_str}\n\n"
-        "Вода:\n"
-        f"- Выпито: {d['water_ml']} мл из {water_goal} мл\n"
-        f"- Осталось: {water_left} мл\n\n"
-        "Калории:\n"
-        f"- Потреблено: {d['cal_in']:.0f} ккал\n"
-        f"- Сожжено: {d['cal_out']:.0f} ккал\n"
-        f"- Баланс: {cal_balance:.0f} ккал\n"
-        f"- Цель: {cal_goal} ккал\n"
-        f"- Осталось до цели: {cal_left:.0f} ккал"
-    )
+    await message.answer(_PROGRESS_TPL.format_map({
+        "temp": temp_str,
+        "drunk": d["water_ml"],
+        "water_goal": water_goal,
+        "water_left": water_left,
+        "cal_in": d["cal_in"],
+        "cal_out": d["cal_out"],
+        "cal_balance": cal_balance,
+        "cal_goal": cal_goal,
+        "cal_left": cal_left,
+    }))
 
 
 async def main():
+    global http, _flush_task
+    connector = aiohttp.TCPConnector(limit_per_host=32, keepalive_timeout=85, ttl_dns_cache=300)
+    http = aiohttp.ClientSession(connector=connector)
+
+    if redis_db is not None:
+        _flush_task = asyncio.create_task(_flush_loop())
     log.info("bot started")
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())